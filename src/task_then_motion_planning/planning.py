@@ -1,8 +1,13 @@
 """Planning interface."""
 
-from typing import Any, Generic
+import shutil
+import tempfile
+from collections import deque
+from pathlib import Path
+from typing import Any, Generic, Sequence
 
 from relational_structs import (
+    GroundAtom,
     GroundOperator,
     LiftedOperator,
     PDDLDomain,
@@ -13,13 +18,133 @@ from relational_structs import (
 from relational_structs.utils import parse_pddl_plan
 from tomsutils.pddl_planning import run_pddl_planner
 
-from task_then_motion_planning.structs import Perceiver, Skill, _Action, _Observation
+from task_then_motion_planning.structs import (
+    LiftedOperatorSkill,
+    Perceiver,
+    Skill,
+    _Action,
+    _Observation,
+)
 
 
 class TaskThenMotionPlanningFailure(Exception):
     """Raised when task then motion planning fails."""
 
 
+# Distinguishes "no observation seen yet" from any real observation.
+_SENTINEL = object()
+
+
+def compute_parallel_stages(
+    plan: Sequence[GroundOperator],
+) -> list[list[GroundOperator]]:
+    """Group consecutive mutually-independent operators into stages.
+
+    Operators are grouped greedily: an operator joins the current stage
+    if its preconditions and effects are disjoint from the effects of
+    every operator already in the stage, and its effects do not touch
+    any of their preconditions. Operators within a stage can therefore
+    be executed in any order, or concurrently in environments that
+    support dispatching multiple skills at once. Concatenating the
+    stages in order recovers exactly the input plan.
+    """
+    stages: list[list[GroundOperator]] = []
+    current_stage: list[GroundOperator] = []
+    stage_preconditions: set[GroundAtom] = set()
+    stage_effects: set[GroundAtom] = set()
+    for operator in plan:
+        effects = operator.add_effects | operator.delete_effects
+        independent = stage_effects.isdisjoint(
+            operator.preconditions | effects
+        ) and stage_preconditions.isdisjoint(effects)
+        if current_stage and not independent:
+            stages.append(current_stage)
+            current_stage = []
+            stage_preconditions = set()
+            stage_effects = set()
+        current_stage.append(operator)
+        stage_preconditions |= operator.preconditions
+        stage_effects |= effects
+    if current_stage:
+        stages.append(current_stage)
+    return stages
+
+
+def compute_goal_subplans(
+    plan: Sequence[GroundOperator], goal: set[GroundAtom]
+) -> list[tuple[frozenset[GroundAtom], list[GroundOperator]]]:
+    """Partition a plan into subplans that achieve independent subgoals.
+
+    Each goal atom is anchored to the last operator in the plan that
+    produces it, and the operators supporting that goal atom are found by
+    back-chaining through preconditions. Clusters that share operators
+    are merged. If the resulting clusters cover the whole plan and are
+    pairwise disjoint in the atoms they touch, each (subgoal, subplan)
+    pair can be executed independently of the others, e.g., concurrently;
+    otherwise the whole plan is returned as a single subplan for the full
+    goal.
+    """
+    if not plan:
+        return []
+    # Cluster each produced goal atom with its supporting operators.
+    clusters: list[tuple[set[GroundAtom], set[int]]] = []
+    for goal_atom in goal:
+        producer_idx = None
+        for idx in range(len(plan) - 1, -1, -1):
+            if goal_atom in plan[idx].add_effects:
+                producer_idx = idx
+                break
+        if producer_idx is None:
+            # The goal atom is not produced by the plan, e.g., it holds
+            # initially, so no operators are needed for it.
+            continue
+        member_idxs = {producer_idx}
+        needed = set(plan[producer_idx].preconditions)
+        for idx in range(producer_idx - 1, -1, -1):
+            if not needed.isdisjoint(plan[idx].add_effects):
+                member_idxs.add(idx)
+                needed |= plan[idx].preconditions
+        clusters.append(({goal_atom}, member_idxs))
+    # Merge clusters that share operators.
+    merged = True
+    while merged:
+        merged = False
+        for i, (goal_atoms_i, member_idxs_i) in enumerate(clusters):
+            for j in range(i + 1, len(clusters)):
+                goal_atoms_j, member_idxs_j = clusters[j]
+                if not member_idxs_i.isdisjoint(member_idxs_j):
+                    goal_atoms_i.update(goal_atoms_j)
+                    member_idxs_i.update(member_idxs_j)
+                    del clusters[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    # The decomposition is only usable if every operator supports some
+    # goal atom and no two clusters touch the same atoms.
+    covered: set[int] = set()
+    footprints: list[set[GroundAtom]] = []
+    for _, member_idxs in clusters:
+        covered |= member_idxs
+        footprint: set[GroundAtom] = set()
+        for idx in member_idxs:
+            op = plan[idx]
+            footprint |= op.preconditions | op.add_effects | op.delete_effects
+        footprints.append(footprint)
+    independent = covered == set(range(len(plan))) and all(
+        footprints[i].isdisjoint(footprints[j])
+        for i in range(len(footprints))
+        for j in range(i + 1, len(footprints))
+    )
+    if not independent:
+        return [(frozenset(goal), list(plan))]
+    clusters.sort(key=lambda cluster: min(cluster[1]))
+    return [
+        (frozenset(goal_atoms), [plan[idx] for idx in sorted(member_idxs)])
+        for goal_atoms, member_idxs in clusters
+    ]
+
+
 class TaskThenMotionPlanner(Generic[_Observation, _Action]):
     """Run task then motion planning with greedy execution."""
 
@@ -33,52 +158,139 @@ class TaskThenMotionPlanner(Generic[_Observation, _Action]):
         planner_id: str = "fd-sat",
         domain_name: str = "ttmp-domain",
     ) -> None:
-        self._types = types
-        self._predicates = predicates
+        # Freeze the input collections: the planner never mutates them, and
+        # freezing makes them safely shareable and hashable for downstream
+        # caching.
+        self._types = frozenset(types)
+        self._predicates = frozenset(predicates)
         self._perceiver = perceiver
-        self._operators = operators
-        self._skills = skills
+        self._perceiver_supports_delta = (
+            type(perceiver).step_delta is not Perceiver.step_delta
+        )
+        # Pre-bind the perceiver methods called on every tick so that the
+        # hot path in step() skips repeated attribute lookups.
+        self._perceiver_step = perceiver.step
+        self._perceiver_step_delta = perceiver.step_delta
+        self._operators = frozenset(operators)
+        self._skills = frozenset(skills)
         self._planner_id = planner_id
         self._domain_name = domain_name
         self._domain = PDDLDomain(
             self._domain_name, self._operators, self._predicates, self._types
         )
+        # Memoize skill dispatch for LiftedOperatorSkills, which are
+        # one-to-one with lifted operators, so that operator transitions do
+        # an O(1) lookup instead of scanning the whole skill set.
+        self._lifted_operator_to_skill: dict[LiftedOperator, Skill] = {}
+        for skill in self._skills:
+            # pylint: disable=protected-access
+            if skill._is_lifted_operator_skill:
+                assert isinstance(skill, LiftedOperatorSkill)
+                lifted_operator = skill._get_lifted_operator()
+                assert (
+                    lifted_operator not in self._lifted_operator_to_skill
+                ), "Multiple skills per operator not supported"
+                self._lifted_operator_to_skill[lifted_operator] = skill
+        # In the common case that every skill is a LiftedOperatorSkill,
+        # dispatch can skip the fallback scan entirely.
+        self._all_skills_are_lifted = len(self._lifted_operator_to_skill) == len(
+            self._skills
+        )
+        # The domain is fixed after construction, so cache its PDDL string
+        # instead of re-serializing it on every reset().
+        self._domain_str: str = str(self._domain)
+        # Also write the domain PDDL to disk once, so that planners invoked
+        # by file path need not receive (and re-write) the domain per
+        # episode.
+        self._domain_dir = Path(tempfile.mkdtemp())
+        self._domain_path = self._domain_dir / "domain.pddl"
+        self._domain_path.write_text(self._domain_str, encoding="utf-8")
         self._current_problem: PDDLProblem | None = None
-        self._current_task_plan: list[GroundOperator] = []
+        # Use a deque so that step() can pop from the front in O(1).
+        self._current_task_plan: deque[GroundOperator] = deque()
         self._current_operator: GroundOperator | None = None
+        # The current operator's effects, hoisted into frozensets when the
+        # operator starts so the per-step termination check avoids repeated
+        # attribute lookups on the GroundOperator.
+        self._current_op_add: frozenset[GroundAtom] = frozenset()
+        self._current_op_del: frozenset[GroundAtom] = frozenset()
         self._current_skill: Skill | None = None
+        # Cache the most recent perceiver.step() result so that repeated
+        # steps on an unchanged observation skip re-parsing.
+        self._last_obs: Any = _SENTINEL
+        self._last_atoms: set[GroundAtom] | None = None
+        # Incrementally maintained atoms for perceivers with step_delta().
+        self._current_atoms: set[GroundAtom] | None = None
+        # Set once the task plan has been exhausted, so that subsequent
+        # step() calls fail immediately.
+        self._terminated = False
 
     def reset(self, obs: _Observation, info: dict[str, Any]) -> None:
         """Reset on a new task instance."""
         objects, atoms, goal = self._perceiver.reset(obs, info)
+        self._current_atoms = set(atoms)
         self._current_problem = PDDLProblem(
             self._domain_name, self._domain_name, objects, atoms, goal
         )
         plan_str = run_pddl_planner(
-            str(self._domain), str(self._current_problem), planner=self._planner_id
+            self._domain_str, str(self._current_problem), planner=self._planner_id
         )
         assert plan_str is not None
-        self._current_task_plan = parse_pddl_plan(
-            plan_str, self._domain, self._current_problem
+        self._current_task_plan = deque(
+            parse_pddl_plan(plan_str, self._domain, self._current_problem)
         )
         self._current_operator = None
         self._current_skill = None
+        self._last_obs = _SENTINEL
+        self._last_atoms = None
+        self._terminated = False
 
     def step(self, obs: _Observation) -> _Action:
         """Get an action to execute."""
-        # Get the current atoms.
-        atoms = self._perceiver.step(obs)
+        # Once the plan has been exhausted, fail immediately rather than
+        # re-perceiving and re-checking termination.
+        if self._terminated:
+            raise TaskThenMotionPlanningFailure("Empty task plan")
+
+        # A skill that is mid-execution cannot have terminated its
+        # operator, so skip perception and the termination check.
+        if self._current_skill is not None and self._current_skill.is_mid_execution():
+            return self._current_skill.get_action(obs)
+
+        # Get the current atoms. Perceivers that support deltas update an
+        # incrementally maintained atom set in place; otherwise, reuse the
+        # last full parse if the observation has not changed since the
+        # previous step. Note that the unchanged check compares against a
+        # stored reference, so an environment that mutates its observation
+        # objects in place will compare equal to itself and get stale
+        # atoms; such observations should be copied before being passed in.
+        if self._perceiver_supports_delta and self._current_atoms is not None:
+            added, removed = self._perceiver_step_delta(obs)
+            self._current_atoms |= added
+            self._current_atoms -= removed
+            atoms = self._current_atoms
+        else:
+            try:
+                obs_unchanged = bool(obs == self._last_obs)
+            except (TypeError, ValueError):  # e.g., array-valued observations
+                obs_unchanged = False
+            if obs_unchanged and self._last_atoms is not None:
+                atoms = self._last_atoms
+            else:
+                atoms = self._perceiver_step(obs)
+                self._last_obs = obs
+                self._last_atoms = atoms
 
         # If the current operator is None or terminated, get the next one.
-        if self._current_operator is None or (
-            self._current_operator.add_effects.issubset(atoms)
-            and not (self._current_operator.delete_effects & atoms)
-        ):
+        if self._current_operator is None or self._operator_terminated(atoms):
             # If there is no more plan to execute, fail.
-            if not self._current_task_plan:
+            try:
+                self._current_operator = self._current_task_plan.popleft()
+            except IndexError:
+                self._terminated = True
                 raise TaskThenMotionPlanningFailure("Empty task plan")
-
-            self._current_operator = self._current_task_plan.pop(0)
+            self._current_op_add = frozenset(self._current_operator.add_effects)
+            self._current_op_del = frozenset(self._current_operator.delete_effects)
             # Get a skill that can execute this operator.
             self._current_skill = self._get_skill_for_operator(self._current_operator)
             self._current_skill.reset(self._current_operator)
@@ -86,11 +298,58 @@ class TaskThenMotionPlanner(Generic[_Observation, _Action]):
         assert self._current_skill is not None
         return self._current_skill.get_action(obs)
 
+    def _operator_terminated(self, atoms: set[GroundAtom]) -> bool:
+        """Check whether the current operator's effects hold in the given
+        atoms.
+
+        This runs on every environment tick, so check the smaller of the
+        hoisted effect sets first and use isdisjoint(), which short-
+        circuits, rather than materializing an intersection.
+        """
+        add_effects = self._current_op_add
+        delete_effects = self._current_op_del
+        if len(delete_effects) < len(add_effects):
+            return delete_effects.isdisjoint(atoms) and add_effects.issubset(atoms)
+        return add_effects.issubset(atoms) and delete_effects.isdisjoint(atoms)
+
+    @property
+    def domain_path(self) -> Path:
+        """The path to the cached domain PDDL file.
+
+        The file lives for the lifetime of the planner and can be handed
+        directly to external planners that accept file paths.
+        """
+        return self._domain_path
+
+    def invalidate_domain_cache(self) -> None:
+        """Re-serialize the domain, e.g., after a subclass mutates it."""
+        self._domain_str = str(self._domain)
+        self._domain_path.write_text(self._domain_str, encoding="utf-8")
+
+    def __del__(self) -> None:
+        shutil.rmtree(self._domain_dir, ignore_errors=True)
+
     def _get_skill_for_operator(
         self, operator: GroundOperator
     ) -> Skill[_Observation, _Action]:
-        applicable_skills = [s for s in self._skills if s.can_execute(operator)]
-        if not applicable_skills:
+        parent = operator.parent
+        assert parent is not None
+        if self._all_skills_are_lifted:
+            try:
+                return self._lifted_operator_to_skill[parent]
+            except KeyError:
+                raise TaskThenMotionPlanningFailure("No skill can execute operator")
+        skill = self._lifted_operator_to_skill.get(parent)
+        if skill is not None:
+            return skill
+        # Fall back to a linear scan for skills that are not
+        # LiftedOperatorSkills, stopping at the first applicable one rather
+        # than building an intermediate list.
+        applicable_skills = (s for s in self._skills if s.can_execute(operator))
+        skill = next(applicable_skills, None)
+        if skill is None:
             raise TaskThenMotionPlanningFailure("No skill can execute operator")
-        assert len(applicable_skills) == 1, "Multiple operators per skill not supported"
-        return applicable_skills[0]
+        assert (
+            next(applicable_skills, None) is None
+        ), "Multiple operators per skill not supported"
+        return skill
@@ -26,6 +26,11 @@ class Skill(abc.ABC, Generic[_Observation, _Action]):
     after each execution.
     """
 
+    # Type tag for hot dispatch paths: reading a class attribute is much
+    # cheaper than isinstance() through ABCMeta. Overridden by
+    # LiftedOperatorSkill.
+    _is_lifted_operator_skill = False
+
     def __init__(self) -> None:
         self._current_ground_operator: GroundOperator | None = None
 
@@ -46,6 +51,15 @@ class Skill(abc.ABC, Generic[_Observation, _Action]):
         be executed.
         """
 
+    def is_mid_execution(self) -> bool:
+        """Whether the skill is partway through a multi-step execution.
+
+        Skills with internal memory, e.g., an action queue, can override
+        this so that external control flow knows the skill cannot have
+        finished its operator yet and skips termination checking.
+        """
+        return False
+
     def reset(self, ground_operator: GroundOperator) -> None:
         """Reset any internal memory given a ground operator that can be
         executed."""
@@ -56,6 +70,8 @@ class Skill(abc.ABC, Generic[_Observation, _Action]):
 class LiftedOperatorSkill(Skill[_Observation, _Action]):
     """A skill that is one-to-one with a specific LiftedOperator."""
 
+    _is_lifted_operator_skill = True
+
     @abc.abstractmethod
     def _get_lifted_operator(self) -> LiftedOperator:
         """Return the lifted operator for this skill."""
@@ -99,3 +115,14 @@ class Perceiver(abc.ABC, Generic[_Observation]):
     @abc.abstractmethod
     def step(self, obs: _Observation) -> set[GroundAtom]:
         """Get the current ground atoms and advance memory."""
+
+    def step_delta(self, obs: _Observation) -> tuple[set[GroundAtom], set[GroundAtom]]:
+        """Get the atoms added and removed since the last call, and advance
+        memory.
+
+        Perceivers that can diff observations incrementally can override
+        this so that callers maintain an atom set in place instead of
+        receiving a freshly computed one from step(). Not supported by
+        default.
+        """
+        raise NotImplementedError("This perceiver does not support deltas")
@@ -3,10 +3,13 @@
 from __future__ import annotations
 
 import abc
+import functools
+from collections import deque
 from typing import Any, Sequence
 
 import gymnasium as gym
 import numpy as np
+import pytest
 from relational_structs import (
     GroundAtom,
     GroundOperator,
@@ -15,9 +18,13 @@ from relational_structs import (
     Predicate,
     Type,
 )
-from tomsutils.search import run_astar
 
-from task_then_motion_planning.planning import TaskThenMotionPlanner
+from task_then_motion_planning.planning import (
+    TaskThenMotionPlanner,
+    TaskThenMotionPlanningFailure,
+    compute_goal_subplans,
+    compute_parallel_stages,
+)
 from task_then_motion_planning.structs import LiftedOperatorSkill, Perceiver
 
 
@@ -42,20 +49,14 @@ def test_task_then_motion_planner():
     # Helper function for parsing observations.
     dropoff_locs = list(env.unwrapped.locs)
 
+    @functools.lru_cache(maxsize=500)  # the Taxi state space has 500 obs
     def _parse_taxi_obs(
         i: int,
     ) -> tuple[tuple[int, int], tuple[int, int] | None, tuple[int, int]]:
-        out = []
-        out.append(i % 4)
-        i = i // 4
-        out.append(i % 5)
-        i = i // 5
-        out.append(i % 5)
-        i = i // 5
-        out.append(i)
-        assert 0 <= i < 5
-        taxi_row, taxi_col, pass_loc_idx, dest_idx = reversed(out)
-        taxi_loc = (taxi_row, taxi_col)
+        i, dest_idx = divmod(i, 4)
+        i, pass_loc_idx = divmod(i, 5)
+        taxi_loc = divmod(i, 5)  # (taxi_row, taxi_col)
+        assert 0 <= taxi_loc[0] < 5
         if pass_loc_idx >= len(dropoff_locs):
             pass_loc: tuple[int, int] | None = None
         else:
@@ -75,6 +76,11 @@ def test_task_then_motion_planner():
     AtDestination = Predicate("AtDestination", [passenger_type, destination_type])
     predicates = {TaxiEmpty, InTaxi, AtDestination}
 
+    # Create the destination objects up front and keep a reverse map from
+    # object to grid location, so skills need not re-parse object names.
+    destinations = {(r, c): destination_type(f"dest-{r}-{c}") for r, c in dropoff_locs}
+    destination_coords = {obj: loc for loc, obj in destinations.items()}
+
     # Create perceiver.
     class TaxiPerceiver(Perceiver[int]):
         """A perceiver for the taxi environment."""
@@ -82,8 +88,14 @@ def test_task_then_motion_planner():
         def __init__(self) -> None:
             self._taxi = taxi_type("taxi")
             self._passenger = passenger_type("passenger")
-            self._destinations = {
-                (r, c): destination_type(f"dest-{r}-{c}") for r, c in dropoff_locs
+            self._destinations = destinations
+            # Pre-ground every atom that can appear so that parsing an
+            # observation reuses cached GroundAtoms instead of allocating.
+            self._in_taxi_atom = InTaxi([self._passenger, self._taxi])
+            self._taxi_empty_atom = TaxiEmpty([self._taxi])
+            self._at_dest_atoms = {
+                loc: AtDestination([self._passenger, dest])
+                for loc, dest in self._destinations.items()
             }
 
         def reset(
@@ -108,15 +120,13 @@ def test_task_then_motion_planner():
             # Create current atoms.
             atoms: set[GroundAtom] = set()
             if pass_loc is None:
-                atoms.add(InTaxi([self._passenger, self._taxi]))
+                atoms.add(self._in_taxi_atom)
             else:
-                atoms.add(TaxiEmpty([self._taxi]))
-                atoms.add(
-                    AtDestination([self._passenger, self._destinations[pass_loc]])
-                )
+                atoms.add(self._taxi_empty_atom)
+                atoms.add(self._at_dest_atoms[pass_loc])
 
             # Create goal atoms.
-            goal = {AtDestination([self._passenger, self._destinations[dest_loc]])}
+            goal = {self._at_dest_atoms[dest_loc]}
 
             return atoms, goal
 
@@ -143,7 +153,40 @@ def test_task_then_motion_planner():
     )
     operators = {PickUpOperator, DropOffOperator}
 
-    # Create skills.
+    # Create skills. The grid is static and small, so instead of searching
+    # per skill activation, precompute the shortest action sequence to each
+    # destination from every free cell with one reverse BFS per destination.
+    delta_to_move_action = {
+        (1, 0): 0,
+        (-1, 0): 1,
+        (0, 1): 2,
+        (0, -1): 3,
+    }
+
+    # Cells are packed as r * n_cols + c so that path bookkeeping and
+    # lookups hash a single int instead of a tuple.
+    n_rows, n_cols = grid.shape
+
+    def _compute_paths(dest: tuple[int, int]) -> dict[int, list[int]]:
+        paths: dict[int, list[int]] = {dest[0] * n_cols + dest[1]: []}
+        queue = deque([dest])
+        while queue:
+            r, c = queue.popleft()
+            packed = r * n_cols + c
+            for (dr, dc), action in delta_to_move_action.items():
+                # The cell that reaches (r, c) by taking this action.
+                pr, pc = r - dr, c - dc
+                if not (0 <= pr < n_rows and 0 <= pc < n_cols):
+                    continue
+                packed_parent = pr * n_cols + pc
+                if grid[pr, pc] or packed_parent in paths:
+                    continue
+                paths[packed_parent] = [action] + paths[packed]
+                queue.append((pr, pc))
+        return paths
+
+    path_cache: dict[tuple[int, int], dict[int, list[int]]] = {}
+
     class TaxiSkill(LiftedOperatorSkill[int, int]):
         """Shared functionality."""
 
@@ -159,46 +202,20 @@ def test_task_then_motion_planner():
             self._action_queue = []
             return super().reset(ground_operator)
 
+        def is_mid_execution(self) -> bool:
+            return bool(self._action_queue)
+
         def _get_action_given_objects(self, objects: Sequence[Object], obs: int) -> int:
             if self._action_queue:
                 return self._action_queue.pop(0)
 
             taxi_loc, _, _ = _parse_taxi_obs(obs)
             _, _, destination = objects
-            destination_loc = (
-                int(destination.name.split("-")[1]),
-                int(destination.name.split("-")[2]),
-            )
-            dest_r, dest_c = destination_loc
-            initial_state = taxi_loc
-
-            check_goal = lambda s: s == destination_loc
-
-            delta_to_move_action = {
-                (1, 0): 0,
-                (-1, 0): 1,
-                (0, 1): 2,
-                (0, -1): 3,
-            }
-
-            def get_successors(s):
-                r, c = s
-                for (dr, dc), action in delta_to_move_action.items():
-                    new_row, new_col = r + dr, c + dc
-                    if not (
-                        0 <= new_row < grid.shape[0] and 0 <= new_col < grid.shape[1]
-                    ):
-                        continue
-                    if grid[new_row, new_col]:
-                        continue
-                    yield (action, (new_row, new_col), 1.0)
-
-            def heuristic(s):
-                r, c = s
-                return abs(r - dest_r) + abs(c - dest_c)
-
-            _, actions = run_astar(initial_state, check_goal, get_successors, heuristic)
-            assert actions
+            destination_loc = destination_coords[destination]
+            if destination_loc not in path_cache:
+                path_cache[destination_loc] = _compute_paths(destination_loc)
+            packed_loc = taxi_loc[0] * n_cols + taxi_loc[1]
+            actions = path_cache[destination_loc][packed_loc]
             self._action_queue = list(actions) + [self._get_final_action()]
 
             return self._action_queue.pop(0)
@@ -240,3 +257,238 @@ def test_task_then_motion_planner():
         assert False, "Goal not reached"
 
     env.close()
+
+
+def test_perceiver_step_delta():
+    """Tests that the planner maintains atoms from Perceiver.step_delta()."""
+    cup_type = Type("cup_type")
+    plate_type = Type("plate_type")
+    on = Predicate("On", [cup_type, plate_type])
+    not_on = Predicate("NotOn", [cup_type, plate_type])
+    cup_var = cup_type("?cup")
+    plate_var = plate_type("?plate")
+    place_operator = LiftedOperator(
+        "Place",
+        [cup_var, plate_var],
+        preconditions={not_on([cup_var, plate_var])},
+        add_effects={on([cup_var, plate_var])},
+        delete_effects={not_on([cup_var, plate_var])},
+    )
+    cup = cup_type("cup")
+    plate = plate_type("plate")
+    on_atom = GroundAtom(on, [cup, plate])
+    not_on_atom = GroundAtom(not_on, [cup, plate])
+
+    class DeltaPerceiver(Perceiver[int]):
+        """Reports atom deltas; obs 0 means NotOn holds and 1 means On."""
+
+        def __init__(self) -> None:
+            self._last_obs: int | None = None
+            self.step_calls = 0
+
+        def reset(
+            self,
+            obs: int,
+            info: dict[str, Any],
+        ) -> tuple[set[Object], set[GroundAtom], set[GroundAtom]]:
+            self._last_obs = obs
+            return {cup, plate}, {not_on_atom}, {on_atom}
+
+        def step(self, obs: int) -> set[GroundAtom]:
+            self.step_calls += 1
+            return {not_on_atom} if obs == 0 else {on_atom}
+
+        def step_delta(self, obs: int) -> tuple[set[GroundAtom], set[GroundAtom]]:
+            if obs == self._last_obs:
+                return set(), set()
+            self._last_obs = obs
+            if obs == 1:
+                return {on_atom}, {not_on_atom}
+            return {not_on_atom}, {on_atom}
+
+    class PlaceSkill(LiftedOperatorSkill[int, int]):
+        """Skill for the Place operator."""
+
+        def _get_lifted_operator(self) -> LiftedOperator:
+            return place_operator
+
+        def _get_action_given_objects(self, objects: Sequence[Object], obs: int) -> int:
+            return 0
+
+    perceiver = DeltaPerceiver()
+    planner = TaskThenMotionPlanner(
+        {cup_type, plate_type},
+        {on, not_on},
+        perceiver,
+        {place_operator},
+        {PlaceSkill()},
+        planner_id="pyperplan",
+    )
+    planner.reset(0, {})
+
+    # The first step starts the Place operator.
+    assert planner.step(0) == 0
+
+    # The delta flips NotOn to On, so the maintained atom set terminates the
+    # operator and the plan is exhausted.
+    with pytest.raises(TaskThenMotionPlanningFailure):
+        planner.step(1)
+
+    # All atoms came through step_delta(); step() was never needed.
+    assert perceiver.step_calls == 0
+
+
+def test_unchanged_observation_cache():
+    """Tests that step() reuses atoms when the observation is unchanged."""
+    cup_type = Type("cup_type")
+    plate_type = Type("plate_type")
+    on = Predicate("On", [cup_type, plate_type])
+    not_on = Predicate("NotOn", [cup_type, plate_type])
+    cup_var = cup_type("?cup")
+    plate_var = plate_type("?plate")
+    place_operator = LiftedOperator(
+        "Place",
+        [cup_var, plate_var],
+        preconditions={not_on([cup_var, plate_var])},
+        add_effects={on([cup_var, plate_var])},
+        delete_effects={not_on([cup_var, plate_var])},
+    )
+    cup = cup_type("cup")
+    plate = plate_type("plate")
+    on_atom = GroundAtom(on, [cup, plate])
+    not_on_atom = GroundAtom(not_on, [cup, plate])
+
+    class CountingPerceiver(Perceiver[int]):
+        """Counts step() calls; obs 0 means NotOn holds and 1 means On."""
+
+        def __init__(self) -> None:
+            self.step_calls = 0
+
+        def reset(
+            self,
+            obs: int,
+            info: dict[str, Any],
+        ) -> tuple[set[Object], set[GroundAtom], set[GroundAtom]]:
+            return {cup, plate}, {not_on_atom}, {on_atom}
+
+        def step(self, obs: int) -> set[GroundAtom]:
+            self.step_calls += 1
+            return {not_on_atom} if obs == 0 else {on_atom}
+
+    class PlaceSkill(LiftedOperatorSkill[int, int]):
+        """Skill for the Place operator."""
+
+        def _get_lifted_operator(self) -> LiftedOperator:
+            return place_operator
+
+        def _get_action_given_objects(self, objects: Sequence[Object], obs: int) -> int:
+            return 0
+
+    perceiver = CountingPerceiver()
+    planner = TaskThenMotionPlanner(
+        {cup_type, plate_type},
+        {on, not_on},
+        perceiver,
+        {place_operator},
+        {PlaceSkill()},
+        planner_id="pyperplan",
+    )
+    planner.reset(0, {})
+
+    # The first step parses the observation and starts the Place operator.
+    assert planner.step(0) == 0
+    assert perceiver.step_calls == 1
+
+    # Repeating an equal observation reuses the cached atoms.
+    assert planner.step(0) == 0
+    assert perceiver.step_calls == 1
+
+
+def test_compute_parallel_stages():
+    """Tests for compute_parallel_stages()."""
+    block_type = Type("block")
+    clear = Predicate("Clear", [block_type])
+    held = Predicate("Held", [block_type])
+    block_var = block_type("?block")
+    pick = LiftedOperator(
+        "Pick",
+        [block_var],
+        preconditions={clear([block_var])},
+        add_effects={held([block_var])},
+        delete_effects={clear([block_var])},
+    )
+    place = LiftedOperator(
+        "Place",
+        [block_var],
+        preconditions={held([block_var])},
+        add_effects={clear([block_var])},
+        delete_effects={held([block_var])},
+    )
+    block1 = block_type("block1")
+    block2 = block_type("block2")
+    pick1 = pick.ground((block1,))
+    pick2 = pick.ground((block2,))
+    place1 = place.ground((block1,))
+
+    # Operators on different blocks are independent and share a stage.
+    assert compute_parallel_stages([pick1, pick2]) == [[pick1, pick2]]
+
+    # An operator that consumes what an earlier one produced starts a new
+    # stage.
+    assert compute_parallel_stages([pick1, place1]) == [[pick1], [place1]]
+
+    # The empty plan has no stages.
+    assert not compute_parallel_stages([])
+
+    # Concatenating the stages in order recovers the plan.
+    plan = [pick1, pick2, place1]
+    stages = compute_parallel_stages(plan)
+    assert [o for stage in stages for o in stage] == plan
+
+
+def test_compute_goal_subplans():
+    """Tests for compute_goal_subplans()."""
+    block_type = Type("block")
+    clear = Predicate("Clear", [block_type])
+    held = Predicate("Held", [block_type])
+    block_var = block_type("?block")
+    pick = LiftedOperator(
+        "Pick",
+        [block_var],
+        preconditions={clear([block_var])},
+        add_effects={held([block_var])},
+        delete_effects={clear([block_var])},
+    )
+    place = LiftedOperator(
+        "Place",
+        [block_var],
+        preconditions={held([block_var])},
+        add_effects={clear([block_var])},
+        delete_effects={held([block_var])},
+    )
+    block1 = block_type("block1")
+    block2 = block_type("block2")
+    pick1 = pick.ground((block1,))
+    pick2 = pick.ground((block2,))
+    place1 = place.ground((block1,))
+    held1 = GroundAtom(held, [block1])
+    held2 = GroundAtom(held, [block2])
+    clear1 = GroundAtom(clear, [block1])
+
+    # The empty plan has no subplans.
+    assert not compute_goal_subplans([], {held1})
+
+    # Goals on different blocks decompose into independent subplans.
+    subplans = compute_goal_subplans([pick1, pick2], {held1, held2})
+    assert subplans == [
+        (frozenset({held1}), [pick1]),
+        (frozenset({held2}), [pick2]),
+    ]
+
+    # Back-chaining pulls in the operators that support a goal producer.
+    subplans = compute_goal_subplans([pick1, place1], {clear1})
+    assert subplans == [(frozenset({clear1}), [pick1, place1])]
+
+    # If an operator supports no goal atom, the plan is not decomposed.
+    subplans = compute_goal_subplans([pick1, pick2], {held1})
+    assert subplans == [(frozenset({held1}), [pick1, pick2])]
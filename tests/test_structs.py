@@ -2,6 +2,7 @@
 
 from typing import Any, Sequence
 
+import pytest
 from relational_structs import GroundAtom, LiftedOperator, Object, Predicate, Type
 
 from task_then_motion_planning.structs import LiftedOperatorSkill, Perceiver
@@ -42,6 +43,7 @@ def test_lifted_operator_skill():
             return obs + 3
 
     skill = PickSkill()
+    assert not skill.is_mid_execution()
     ground_operator = lifted_operator.ground((cup, plate))
     assert skill.can_execute(ground_operator)
     skill.reset(ground_operator)
@@ -85,3 +87,6 @@ def test_perceiver():
     assert atoms == {GroundAtom(not_on, [cup, plate])}
     atoms = perceiver.step(1)
     assert atoms == {GroundAtom(on, [cup, plate])}
+    # By default, perceivers do not support incremental deltas.
+    with pytest.raises(NotImplementedError):
+        perceiver.step_delta(0)